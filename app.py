@@ -1,17 +1,80 @@
-from fastapi import FastAPI, UploadFile, File
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, UploadFile, File, Query
+from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 import uvicorn
-from color_detection import detect_colors
+from color_detection import detect_colors, _convert_ai_eps_to_raster
 import os
+import asyncio
+import functools
+import json
+import cv2
+import numba
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import OrderedDict
 from typing import Dict, Any, List
-import base64
-from io import BytesIO
+import hashlib
 
 app = FastAPI(title="Color Detection API")
 
-# Create uploads directory if it doesn't exist
-os.makedirs("uploads", exist_ok=True)
+
+class PreviewFiles(StaticFiles):
+    # Previews are user uploads (SVGs can carry scripts); never let them run on our origin
+    async def get_response(self, path, scope):
+        response = await super().get_response(path, scope)
+        response.headers["Content-Security-Policy"] = "default-src 'none'; style-src 'unsafe-inline'; sandbox"
+        return response
+
+
+# Previews are stored by content hash and served as static files instead of inlined base64
+PREVIEW_DIR = "previews"
+os.makedirs(PREVIEW_DIR, exist_ok=True)
+app.mount("/previews", PreviewFiles(directory=PREVIEW_DIR), name="previews")
+
+
+def _init_worker():
+    # The pool already uses every core; keep OpenCV/Numba single-threaded per worker
+    # so N workers don't each spawn N threads
+    os.environ.setdefault('OMP_NUM_THREADS', '1')
+    cv2.setNumThreads(1)
+    numba.set_num_threads(1)
+
+
+# Uvicorn workers and pool processes share the machine: each of the WEB_CONCURRENCY
+# server processes (uvicorn's own --workers default) gets an equal slice of the cores.
+# POOL_WORKERS overrides the per-server pool size.
+UVICORN_WORKERS = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+POOL_WORKERS = max(1, int(os.environ.get("POOL_WORKERS", (os.cpu_count() or 1) // UVICORN_WORKERS)))
+
+
+def _new_pool() -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=POOL_WORKERS, initializer=_init_worker)
+
+
+# Worker processes for CPU-bound color detection
+POOL = _new_pool()
+
+
+async def run_in_pool(func, *args):
+    # A worker that dies (OOM kill, native crash) breaks the whole executor. Replace the
+    # shared pool for later requests, and retry the jobs that were caught in the break
+    # each in its own single-process executor, so a poison file only kills itself
+    global POOL
+    loop = asyncio.get_running_loop()
+    pool = POOL
+    try:
+        return await loop.run_in_executor(pool, func, *args)
+    except BrokenProcessPool:
+        # Concurrent tasks fail together; only the first one swaps the pool
+        if POOL is pool:
+            pool.shutdown(wait=False, cancel_futures=True)
+            POOL = _new_pool()
+    isolated = ProcessPoolExecutor(max_workers=1, initializer=_init_worker)
+    try:
+        return await loop.run_in_executor(isolated, func, *args)
+    finally:
+        isolated.shutdown(wait=False)
+
 
 @app.get("/", response_class=HTMLResponse)
 async def get_upload_page():
@@ -156,6 +219,32 @@ async def get_upload_page():
                     fileInput.click();
                 });
 
+                function renderResult(result) {
+                    if (result.error) {
+                        return `
+                            <div class="logo-result" style="border-color:#f99">
+                                <h3>${result.filename}</h3>
+                                <p style="color:#c00;font-weight:bold;">Error: ${result.error}</p>
+                            </div>
+                        `;
+                    }
+                    return `
+                        <div class="logo-result">
+                            <h3>${result.filename}</h3>
+                            <img src="${result.preview}" class="logo-preview" alt="${result.filename}">
+                            <p>Total Colors Detected: ${result.count}</p>
+                            <div class="colors-grid">
+                                ${result.colors.map(color => `
+                                    <div class="color-item">
+                                        <span class="color-box" style="background-color: ${color}"></span>
+                                        <span>${color}</span>
+                                    </div>
+                                `).join('')}
+                            </div>
+                        </div>
+                    `;
+                }
+
                 document.getElementById('uploadForm').onsubmit = async (e) => {
                     e.preventDefault();
                     const detectBtn = document.getElementById('detectBtn');
@@ -191,39 +280,26 @@ async def get_upload_page():
                             const text = await response.text();
                             throw new Error(text || `Upload failed with status ${response.status}`);
                         }
-                        const data = await response.json();
-                        
-                        let resultsHtml = '<h2>Results:</h2>';
-                        
-                        data.results.forEach(result => {
-                            if (result.error) {
-                                resultsHtml += `
-                                    <div class="logo-result" style="border-color:#f99">
-                                        <h3>${result.filename}</h3>
-                                        <p style="color:#c00;font-weight:bold;">Error: ${result.error}</p>
-                                    </div>
-                                `;
-                                return;
-                            }
-                            resultsHtml += `
-                                <div class="logo-result">
-                                    <h3>${result.filename}</h3>
-                                    <img src="${result.preview}" class="logo-preview" alt="${result.filename}">
-                                    <p>Total Colors Detected: ${result.count}</p>
-                                    <div class="colors-grid">
-                                        ${result.colors.map(color => `
-                                            <div class="color-item">
-                                                <span class="color-box" style="background-color: ${color}"></span>
-                                                <span>${color}</span>
-                                            </div>
-                                        `).join('')}
-                                    </div>
-                                </div>
-                            `;
-                        });
-                        
-                        resultDiv.innerHTML = resultsHtml;
+                        resultDiv.innerHTML = '<h2>Results:</h2>';
                         resultDiv.style.display = 'block';
+
+                        // Results arrive as NDJSON, one line per file as soon as it's processed
+                        const reader = response.body.getReader();
+                        const decoder = new TextDecoder();
+                        let buffered = '';
+                        while (true) {
+                            const { value, done } = await reader.read();
+                            if (done) break;
+                            buffered += decoder.decode(value, { stream: true });
+                            const lines = buffered.split('\\n');
+                            buffered = lines.pop();
+                            lines.filter(line => line.trim()).forEach(line => {
+                                resultDiv.insertAdjacentHTML('beforeend', renderResult(JSON.parse(line)));
+                            });
+                        }
+                        if (buffered.trim()) {
+                            resultDiv.insertAdjacentHTML('beforeend', renderResult(JSON.parse(buffered)));
+                        }
                     } catch (error) {
                         alert('Error uploading files: ' + (error?.message || 'Unknown error'));
                         console.error(error);
@@ -237,77 +313,115 @@ async def get_upload_page():
     </html>
     """
 
+ALLOWED_EXTS = {'.png', '.jpg', '.jpeg', '.svg', '.webp', '.bmp', '.tiff', '.tif', '.gif', '.ai', '.eps'}
+
+
+# LRU of per-file results keyed by the hash of the original upload, so a repeated file
+# (including AI/EPS, whose conversion is the most expensive step) skips all the work.
+# It lives in the server process; pool workers only ever see cache misses
+RESULT_CACHE_MAX_ENTRIES = 512
+_result_cache: "OrderedDict[bytes, Dict[str, Any]]" = OrderedDict()
+# Results still being computed, so duplicates in flight share one pool submission
+_in_flight: Dict[bytes, "asyncio.Future[Dict[str, Any]]"] = {}
+
+
+def _result_key(data: bytes, ext: str, fast_mode: bool) -> bytes:
+    h = hashlib.blake2b(data, digest_size=16)
+    h.update(f"{ext}:{fast_mode}".encode())
+    return h.digest()
+
+
+def analyze_upload(data: bytes, ext: str, fast_mode: bool = False) -> Dict[str, Any]:
+    # Color detection is CPU-bound; the result doesn't depend on the filename so it can be cached
+    if ext in ['.ai', '.eps']:
+        # Convert AI/EPS to PNG once and reuse it for both detection and preview
+        data = _convert_ai_eps_to_raster(data)
+        ext = '.png'
+    count, colors = detect_colors(data, ext, fast_mode)
+
+    # Save the preview under its content hash; identical files share one preview
+    preview_name = hashlib.sha256(data).hexdigest() + ext
+    preview_path = os.path.join(PREVIEW_DIR, preview_name)
+    if not os.path.exists(preview_path):
+        # Write to a per-process temp name first so concurrent requests never see a partial file
+        temp_path = f"{preview_path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as preview_file:
+            preview_file.write(data)
+        os.replace(temp_path, preview_path)
+
+    return {
+        "count": count,
+        "colors": sorted(colors),
+        "preview": f"/previews/{preview_name}"
+    }
+
+
+def _store_result(key: bytes, future: "asyncio.Future[Dict[str, Any]]") -> None:
+    _in_flight.pop(key, None)
+    if future.cancelled() or future.exception() is not None:
+        return
+    _result_cache[key] = future.result()
+    if len(_result_cache) > RESULT_CACHE_MAX_ENTRIES:
+        _result_cache.popitem(last=False)
+
+
+async def get_result(data: bytes, ext: str, fast_mode: bool) -> Dict[str, Any]:
+    key = _result_key(data, ext, fast_mode)
+    result = _result_cache.get(key)
+    if result is not None:
+        # Previews may have been pruned from disk; recompute rather than return a dead URL
+        if os.path.exists(os.path.join(PREVIEW_DIR, os.path.basename(result["preview"]))):
+            _result_cache.move_to_end(key)
+            return result
+        del _result_cache[key]
+    future = _in_flight.get(key)
+    if future is None:
+        # Fan the CPU-bound work out to the process pool so the event loop stays responsive
+        future = asyncio.ensure_future(run_in_pool(analyze_upload, data, ext, fast_mode))
+        _in_flight[key] = future
+        future.add_done_callback(functools.partial(_store_result, key))
+    # Shielded so one client disconnecting doesn't cancel work other uploads are waiting on
+    return await asyncio.shield(future)
+
+
 @app.post("/upload")
-async def upload_files(files: List[UploadFile] = File(...)) -> Dict[str, Any]:
-    results = []
-    allowed_exts = {'.png', '.jpg', '.jpeg', '.svg', '.webp', '.bmp', '.tiff', '.tif', '.gif', '.ai', '.eps'}
-    
+async def upload_files(files: List[UploadFile] = File(...), fast_mode: bool = Query(False)) -> StreamingResponse:
+    rejected = []
+    uploads = []
+
     for file in files:
-        # Save the uploaded file temporarily
-        file_path = f"uploads/{file.filename}"
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        
-        try:
-            # Validate extension early and provide per-file error messages
-            ext = os.path.splitext(file.filename)[1].lower()
-            if ext not in allowed_exts:
-                results.append({
-                    "filename": file.filename,
-                    "error": f"Unsupported file type '{ext}'. Supported: .png, .jpg, .jpeg, .svg, .webp, .bmp, .tiff, .tif, .gif, .ai, .eps"
-                })
-                continue
-
-            # Process the file
-            count, colors = detect_colors(file_path)
-            
-            # Determine MIME type and create preview
-            ext = os.path.splitext(file.filename)[1].lower()
-            preview = None
-            
-            if ext == '.svg':
-                mime = 'image/svg+xml'
-            elif ext in ['.jpg', '.jpeg']:
-                mime = 'image/jpeg'
-            elif ext in ['.ai', '.eps']:
-                # For AI/EPS files, convert to PNG for preview
-                try:
-                    from colordetector import _convert_ai_eps_to_raster
-                    temp_png = _convert_ai_eps_to_raster(file_path)
-                    with open(temp_png, "rb") as png_file:
-                        preview = f"data:image/png;base64," + base64.b64encode(png_file.read()).decode()
-                    os.remove(temp_png)
-                except Exception as e:
-                    # Fallback: use original file if conversion fails
-                    mime = 'application/octet-stream'
-                    with open(file_path, "rb") as image_file:
-                        preview = f"data:{mime};base64," + base64.b64encode(image_file.read()).decode()
-            else:
-                mime = 'image/png'
-            
-            # Create preview image (if not already created for AI/EPS)
-            if preview is None:
-                with open(file_path, "rb") as image_file:
-                    preview = f"data:{mime};base64," + base64.b64encode(image_file.read()).decode()
-            
-            results.append({
+        # Validate extension early and provide per-file error messages
+        ext = os.path.splitext(file.filename)[1].lower()
+        if ext not in ALLOWED_EXTS:
+            rejected.append({
                 "filename": file.filename,
-                "count": count,
-                "colors": list(colors),
-                "preview": preview
+                "error": f"Unsupported file type '{ext}'. Supported: .png, .jpg, .jpeg, .svg, .webp, .bmp, .tiff, .tif, .gif, .ai, .eps"
             })
-            
+            continue
+        uploads.append((await file.read(), file.filename, ext))
+
+    async def run(data: bytes, filename: str, ext: str) -> Dict[str, Any]:
+        try:
+            result = await get_result(data, ext, fast_mode)
         except Exception as e:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-            raise e
-        finally:
-            # Clean up the temporary file
-            if os.path.exists(file_path):
-                os.remove(file_path)
-    
-    return {"results": results}
+            return {"filename": filename, "error": str(e)}
+        return {"filename": filename, **result}
+
+    async def stream():
+        # One NDJSON line per file, in completion order, so clients can render incrementally
+        for result in rejected:
+            yield json.dumps(result) + "\n"
+        for next_result in asyncio.as_completed([run(*upload) for upload in uploads]):
+            yield json.dumps(await next_result) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+    # uvloop is not available on Windows; fall back to the default asyncio loop there
+    try:
+        import uvloop
+        uvloop.install()
+        loop = "uvloop"
+    except ImportError:
+        loop = "auto"
+    uvicorn.run("app:app", host="0.0.0.0", port=8000, loop=loop, http="httptools", workers=UVICORN_WORKERS)
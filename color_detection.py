@@ -1,17 +1,22 @@
 from PIL import Image
 import numpy as np
-from bs4 import BeautifulSoup
+import xml.sax
+from xml.sax.handler import ContentHandler
+from lxml import etree
 import os
 import re
 import cv2
 from typing import Tuple, Set
 import math
-import tempfile
+from io import BytesIO
 import cairosvg
+from numba import njit, prange
 
-def _to_hex(rgb: np.ndarray) -> str:
-    r, g, b = [int(x) for x in rgb]
-    return '#{:02X}{:02X}{:02X}'.format(r, g, b)
+def _to_hex(rgb: np.ndarray) -> np.ndarray:
+    # Vectorized (N, 3) RGB -> '#RRGGBB' strings
+    rgb = np.asarray(rgb, dtype=np.uint32).reshape((-1, 3))
+    codes = (rgb[:, 0] << 16) | (rgb[:, 1] << 8) | rgb[:, 2]
+    return np.char.mod('#%06X', codes)
 
 
 def _has_alpha(pil_img: Image.Image) -> bool:
@@ -25,90 +30,229 @@ def _composite_on_white(pil_img: Image.Image) -> Image.Image:
     return pil_img.convert("RGB")
 
 
-def _resize_max(pil_img: Image.Image, max_dim: int = 800) -> Image.Image:
-    w, h = pil_img.size
+def _decode_rgb_pil(data: bytes) -> np.ndarray:
+    # Fallback for formats OpenCV can't decode (e.g. GIF)
+    with Image.open(BytesIO(data)) as im:
+        # For GIFs and multi-frame images, use the first frame
+        try:
+            im.seek(0)
+        except Exception:
+            pass
+        if _has_alpha(im):
+            im = _composite_on_white(im)
+        else:
+            im = im.convert("RGB")
+    return np.array(im)
+
+
+def _decode_rgb(data: bytes) -> np.ndarray:
+    # Decode straight into a NumPy array with OpenCV; alpha is composited on white
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+    if img is None or img.dtype not in (np.uint8, np.uint16):
+        return _decode_rgb_pil(data)
+    if img.dtype == np.uint16:
+        img = (img >> 8).astype(np.uint8)
+    if img.ndim == 2:
+        return cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
+    if img.shape[2] == 4:
+        alpha = img[:, :, 3:4].astype(np.float32) / 255.0
+        img = (img[:, :, :3] * alpha + 255.0 * (1.0 - alpha)).astype(np.uint8)
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def _resize_max(np_rgb: np.ndarray, max_dim: int = 800) -> np.ndarray:
+    h, w = np_rgb.shape[:2]
     scale = min(1.0, float(max_dim) / float(max(w, h)))
     if scale < 1.0:
-        pil_img = pil_img.resize((int(w * scale), int(h * scale)), Image.LANCZOS)
-    return pil_img
+        np_rgb = cv2.resize(np_rgb, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+    return np_rgb
 
 
+@njit(parallel=True, fastmath=True, cache=True)
 def _gray_world_color_constancy(np_rgb: np.ndarray) -> np.ndarray:
-    # Scale each channel so its mean equals overall gray mean
-    rgb = np_rgb.astype(np.float32) + 1e-6
-    means = rgb.reshape(-1, 3).mean(axis=0)
-    gray = means.mean()
-    scale = gray / means
-    corrected = np.clip(rgb * scale, 0, 255)
-    return corrected.astype(np.uint8)
-
-
+    # Scale each channel so its mean equals overall gray mean, in place on the uint8 buffer.
+    # Means are accumulated in float64, so a small fraction of values can round 1 away
+    # from a float32 implementation; that is well below the clustering's sensitivity
+    h, w, _ = np_rgb.shape
+    sr = 0.0
+    sg = 0.0
+    sb = 0.0
+    for i in prange(h):
+        for j in range(w):
+            sr += np_rgb[i, j, 0]
+            sg += np_rgb[i, j, 1]
+            sb += np_rgb[i, j, 2]
+    n = h * w
+    mr = sr / n + 1e-6
+    mg = sg / n + 1e-6
+    mb = sb / n + 1e-6
+    gray = (mr + mg + mb) / 3.0
+    fr = gray / mr
+    fg = gray / mg
+    fb = gray / mb
+    for i in prange(h):
+        for j in range(w):
+            np_rgb[i, j, 0] = np.uint8(min(255.0, (np_rgb[i, j, 0] + 1e-6) * fr))
+            np_rgb[i, j, 1] = np.uint8(min(255.0, (np_rgb[i, j, 1] + 1e-6) * fg))
+            np_rgb[i, j, 2] = np.uint8(min(255.0, (np_rgb[i, j, 2] + 1e-6) * fb))
+    return np_rgb
+
+
+@njit(cache=True, fastmath=True)
 def _estimate_k(np_lab: np.ndarray) -> int:
     # Simple heuristic using image entropy to choose K in [3, 8]
-    # Compute luminance histogram entropy as a proxy for complexity
-    l_channel = np_lab[:, 0]
-    hist, _ = np.histogram(l_channel, bins=32, range=(0, 255), density=True)
-    hist = hist + 1e-12
-    entropy = -np.sum(hist * np.log2(hist))
+    # Compute luminance histogram entropy as a proxy for complexity,
+    # binning and reducing in one pass (same 32 bins over 0..255 as np.histogram)
+    counts = np.zeros(32, dtype=np.int64)
+    n = np_lab.shape[0]
+    for i in range(n):
+        counts[min(int(np_lab[i, 0]) * 32 // 255, 31)] += 1
+    bin_width = 255.0 / 32.0
+    entropy = 0.0
+    for c in counts:
+        if c:
+            density = c / (n * bin_width)
+            entropy -= density * math.log2(density)
     # Map entropy roughly 0..5 to 3..8
     k = 3 + int(round((min(max(entropy, 0.0), 5.0) / 5.0) * 5))
-    return int(min(max(k, 3), 8))
+    return min(max(k, 3), 8)
 
 
-def _merge_close_lab_colors(centers_lab: np.ndarray, threshold: float = 10.0) -> np.ndarray:
-    # Merge LAB centers within CIE76 distance threshold
-    kept = []
-    for c in centers_lab:
-        if not kept:
-            kept.append(c)
-            continue
-        dists = [np.linalg.norm(c - k) for k in kept]
-        if min(dists) >= threshold:
-            kept.append(c)
-    return np.array(kept, dtype=np.float32)
-
-
-def count_raster_colors(file_path: str) -> Tuple[int, Set[str]]:
-    # Open with Pillow (supports most formats); handle alpha; downscale; color constancy
-    with Image.open(file_path) as im:
-        # For GIFs and multi-frame images, use the first frame
-        try:
-            im.seek(0)
-        except Exception:
-            pass
-        if _has_alpha(im):
-            im = _composite_on_white(im)
-        else:
-            im = im.convert("RGB")
-        im = _resize_max(im, 800)
+def _distinct_lab_mask(centers_lab: np.ndarray, threshold: float = 10.0) -> np.ndarray:
+    # Greedily keep LAB centers that are at least threshold (CIE76) from every earlier kept one
+    diff = centers_lab[:, None, :] - centers_lab[None, :, :]
+    dists = np.sqrt((diff * diff).sum(axis=-1))
+    keep = np.ones(len(centers_lab), dtype=bool)
+    for i in range(len(centers_lab)):
+        if keep[i]:
+            keep[i + 1:] &= dists[i, i + 1:] >= threshold
+    return keep
 
-    np_rgb = np.array(im)
+
+def _merge_close_lab_colors(centers_lab: np.ndarray, threshold: float = 10.0) -> np.ndarray:
+    # Merge LAB centers within CIE76 distance threshold using a pairwise distance matrix
+    centers_lab = np.asarray(centers_lab, dtype=np.float32)
+    return centers_lab[_distinct_lab_mask(centers_lab, threshold)]
+
+
+def _median_cut(pixels: np.ndarray, k: int) -> np.ndarray:
+    # MMCQ-style median cut: repeatedly split the most populous, widest box along
+    # its longest RGB axis at the median until there are k boxes
+    boxes = [pixels]
+    while len(boxes) < k:
+        scores = [len(b) * int(np.ptp(b, axis=0).max()) for b in boxes]
+        i = int(np.argmax(scores))
+        if scores[i] == 0:
+            break
+        box = boxes.pop(i)
+        ch = int(np.argmax(np.ptp(box, axis=0)))
+        values = box[:, ch]
+        median = np.median(values)
+        # Split by value so identical colors never straddle two boxes
+        mask = values <= median
+        if mask.all():
+            mask = values < median
+        boxes += [box[mask], box[~mask]]
+    # Most populous first so merging keeps the dominant color of a near-duplicate pair
+    boxes.sort(key=len, reverse=True)
+    return np.array([b.mean(axis=0) for b in boxes], dtype=np.float32)
+
+
+def _pack_rgb(flat: np.ndarray) -> np.ndarray:
+    flat = flat.astype(np.uint32)
+    return (flat[:, 0] << 16) | (flat[:, 1] << 8) | flat[:, 2]
+
+
+def _exact_colors(np_rgb: np.ndarray, limit: int = 32, probe_size: int = 65536,
+                  min_share: float = 0.01):
+    # Flat-fill logos often have only a handful of exact colors; return them (most
+    # frequent first) when there are at most `limit`, otherwise None. Colors covering
+    # less than `min_share` of the pixels (anti-aliased edge shades) are dropped
+    flat = np_rgb.reshape((-1, 3))
+    # Cheap strided probe first: photos bail out here without sorting every pixel
+    step = max(1, flat.shape[0] // probe_size)
+    if step > 1 and np.unique(_pack_rgb(flat[::step])).size > limit:
+        return None
+    codes, counts = np.unique(_pack_rgb(flat), return_counts=True)
+    if codes.size > limit:
+        return None
+    # The most frequent color covers at least 1/limit of the pixels, so one always survives
+    keep = counts >= min_share * flat.shape[0]
+    codes, counts = codes[keep], counts[keep]
+    codes = codes[np.argsort(-counts, kind='stable')]
+    return np.stack([(codes >> 16) & 0xFF, (codes >> 8) & 0xFF, codes & 0xFF], axis=1).astype(np.uint8)
+
+
+def _palette_to_result(centers_rgb: np.ndarray) -> Set[str]:
+    # Collapse near-white centers to 'white'; everything else (near-black included) is kept as hex
+    centers_rgb = np.asarray(centers_rgb).reshape((-1, 3))
+    white = centers_rgb.min(axis=1) > 245
+    result: Set[str] = set(_to_hex(centers_rgb[~white]).tolist())
+    if white.any():
+        result.add('white')
+    return result
+
+
+def count_raster_colors(data: bytes, fast_mode: bool = False) -> Tuple[int, Set[str]]:
+    # Decode (OpenCV, Pillow fallback); handle alpha; downscale; color constancy
+    np_rgb = _decode_rgb(data)
     if np_rgb.ndim != 3 or np_rgb.shape[2] != 3:
         return 0, set()
 
+    # Fast path: few exact colors means no clustering is needed, only near-duplicate merging
+    exact_rgb = _exact_colors(np_rgb)
+    if exact_rgb is not None:
+        exact_lab = cv2.cvtColor(exact_rgb.reshape((-1, 1, 3)), cv2.COLOR_RGB2LAB).reshape((-1, 3))
+        keep = _distinct_lab_mask(exact_lab.astype(np.float32), threshold=8.0)
+        result = _palette_to_result(exact_rgb[keep])
+        return len(result), result
+
+    np_rgb = _resize_max(np_rgb, 800)
+
     # Denoise while preserving edges to stabilize clustering on textures
-    np_rgb = cv2.bilateralFilter(np_rgb, d=7, sigmaColor=75, sigmaSpace=75)
-    # Color constancy to reduce lighting variation
-    np_rgb = _gray_world_color_constancy(np_rgb)
-
-    # Convert to LAB for perceptual clustering
-    lab_img = cv2.cvtColor(np_rgb, cv2.COLOR_RGB2LAB)
-    pixels_lab = lab_img.reshape((-1, 3)).astype(np.float32)
-
-    # Optional subsample for performance on very large images
-    if pixels_lab.shape[0] > 200000:
-        idx = np.random.choice(pixels_lab.shape[0], 200000, replace=False)
-        sample_lab = pixels_lab[idx]
+    if fast_mode:
+        # Filter a half-size image (4x fewer pixels) and keep working on it;
+        # the pixels are subsampled for clustering anyway. 1-pixel strips can't be halved
+        if min(np_rgb.shape[:2]) >= 2:
+            np_rgb = cv2.resize(np_rgb, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA)
+        np_rgb = cv2.bilateralFilter(np_rgb, d=5, sigmaColor=50, sigmaSpace=50)
     else:
-        sample_lab = pixels_lab
+        np_rgb = cv2.bilateralFilter(np_rgb, d=7, sigmaColor=75, sigmaSpace=75)
 
-    # K-means in LAB space with adaptive K
-    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 50, 0.5)
-    K = _estimate_k(sample_lab)
-    K = min(K, max(3, len(sample_lab)))
-    _compactness, labels, centers_lab = cv2.kmeans(sample_lab, K, None, criteria, 5, cv2.KMEANS_PP_CENTERS)
+    # Subsample before the per-pixel work so only kept pixels are corrected and converted
+    sample_rgb = np_rgb.reshape((-1, 3))
+    if sample_rgb.shape[0] > 200000:
+        idx = np.random.default_rng().choice(sample_rgb.shape[0], 200000, replace=False)
+        sample_rgb = sample_rgb[idx]
+    sample_rgb = np.ascontiguousarray(sample_rgb).reshape((-1, 1, 3))
+
+    # Color constancy to reduce lighting variation (in place on the sample)
+    sample_rgb = _gray_world_color_constancy(sample_rgb)
 
-    # Merge close centers to avoid near-duplicates
+    # LAB luminance drives the adaptive K estimate
+    sample_lab = cv2.cvtColor(sample_rgb, cv2.COLOR_RGB2LAB).reshape((-1, 3))
+    sample_rgb = sample_rgb.reshape((-1, 3))
+
+    # Median-cut quantization in RGB with adaptive K, refined in LAB below
+    K = _estimate_k(sample_lab)
+    K = min(K, max(3, len(sample_rgb)))
+    palette_rgb = np.clip(np.rint(_median_cut(sample_rgb, K)), 0, 255).astype(np.uint8)
+    palette_lab = cv2.cvtColor(palette_rgb.reshape((-1, 1, 3)), cv2.COLOR_RGB2LAB).reshape((-1, 3))
+
+    # Refine with a short single-attempt Lloyd pass in LAB seeded from the median-cut boxes;
+    # median cut alone spends boxes on background noise when one color dominates
+    sample_lab = sample_lab.astype(np.float32)
+    diff = sample_lab[:, None, :] - palette_lab[None, :, :].astype(np.float32)
+    seed_labels = np.argmin((diff * diff).sum(axis=-1), axis=1).astype(np.int32).reshape((-1, 1))
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 10, 0.5)
+    _compactness, labels, centers_lab = cv2.kmeans(
+        sample_lab, len(palette_lab), seed_labels, criteria, 1, cv2.KMEANS_USE_INITIAL_LABELS
+    )
+    # Most populous first so merging keeps the dominant color of a near-duplicate pair
+    sizes = np.bincount(labels.ravel(), minlength=len(centers_lab))
+    centers_lab = centers_lab[np.argsort(-sizes, kind='stable')]
+
+    # Merge close centers in LAB to avoid near-duplicates
     centers_lab = _merge_close_lab_colors(centers_lab, threshold=8.0)
 
     # Convert LAB centers back to RGB
@@ -116,39 +260,22 @@ def count_raster_colors(file_path: str) -> Tuple[int, Set[str]]:
     centers_lab_u8 = centers_lab_u8.reshape((-1, 1, 3))
     centers_rgb = cv2.cvtColor(centers_lab_u8, cv2.COLOR_Lab2RGB).reshape((-1, 3))
 
-    # Filter out near-white and near-black artifacts and tiny clusters
-    result: Set[str] = set()
-    for rgb in centers_rgb:
-        r, g, b = [int(x) for x in rgb]
-        maxc, minc = max(r, g, b), min(r, g, b)
-        if maxc > 245 and minc > 245:
-            result.add('white')
-            continue
-        if maxc < 10 and minc < 10:
-            # treat near-black as a valid color if it’s dominant; keep as hex
-            result.add(_to_hex(rgb))
-            continue
-        result.add(_to_hex(rgb))
-
+    result = _palette_to_result(centers_rgb)
     return len(result), result
 
 
-def _convert_ai_eps_to_raster(file_path: str) -> str:
+def _convert_ai_eps_to_raster(data: bytes) -> bytes:
     """
     Convert .ai or .eps vector files to PNG raster format for color detection.
-    Returns path to temporary PNG file.
+    Returns the PNG-encoded bytes.
     Strategy:
     1. Try PIL directly (works for some EPS files, especially with Ghostscript)
     2. Try converting EPS to SVG-like format then use cairosvg
     3. For AI files, try reading as PDF if they're PDF-based
     """
-    temp_png = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
-    temp_png_path = temp_png.name
-    temp_png.close()
-    
     # Method 1: Try PIL directly (best for EPS files with Ghostscript support)
     try:
-        with Image.open(file_path) as img:
+        with Image.open(BytesIO(data)) as img:
             # Convert to RGB if needed
             if img.mode != 'RGB':
                 if img.mode in ('RGBA', 'LA', 'P'):
@@ -169,40 +296,34 @@ def _convert_ai_eps_to_raster(file_path: str) -> str:
                 new_size = (int(img.size[0] * ratio), int(img.size[1] * ratio))
                 img = img.resize(new_size, Image.LANCZOS)
             
-            # Save as PNG
-            img.save(temp_png_path, 'PNG', dpi=(300, 300))
+            # Encode as PNG
+            buffer = BytesIO()
+            img.save(buffer, 'PNG', dpi=(300, 300))
+            png_data = buffer.getvalue()
             
-            # Verify the saved file
-            with Image.open(temp_png_path) as test_img:
+            # Verify the encoded image
+            with Image.open(BytesIO(png_data)) as test_img:
                 test_img.verify()
             
-            return temp_png_path
+            return png_data
             
     except Exception as e1:
-        # Clean up if failed
-        if os.path.exists(temp_png_path):
-            try:
-                os.remove(temp_png_path)
-            except:
-                pass
-        
         # Method 2: For EPS files, try using cairosvg (if it's SVG-compatible)
         # Some EPS files can be converted this way
         try:
             # Check if file starts with SVG-like content or PostScript
-            with open(file_path, 'rb') as f:
-                header = f.read(100)
-                # If it looks like it might work with cairosvg
-                if b'%!PS' in header or b'<svg' in header or b'<?xml' in header:
-                    try:
-                        cairosvg.svg2png(url=file_path, write_to=temp_png_path, 
-                                       output_width=2000, output_height=2000)
-                        if os.path.exists(temp_png_path) and os.path.getsize(temp_png_path) > 0:
-                            with Image.open(temp_png_path) as test_img:
-                                test_img.verify()
-                            return temp_png_path
-                    except:
-                        pass
+            header = data[:100]
+            # If it looks like it might work with cairosvg
+            if b'%!PS' in header or b'<svg' in header or b'<?xml' in header:
+                try:
+                    png_data = cairosvg.svg2png(bytestring=data,
+                                                output_width=2000, output_height=2000)
+                    if png_data:
+                        with Image.open(BytesIO(png_data)) as test_img:
+                            test_img.verify()
+                        return png_data
+                except:
+                    pass
         except Exception as e2:
             pass
         
@@ -210,10 +331,11 @@ def _convert_ai_eps_to_raster(file_path: str) -> str:
         try:
             import pdf2image
             # AI files are often PDF-based
-            images = pdf2image.convert_from_path(file_path, dpi=300)
+            images = pdf2image.convert_from_bytes(data, dpi=300)
             if images:
-                images[0].save(temp_png_path, 'PNG')
-                return temp_png_path
+                buffer = BytesIO()
+                images[0].save(buffer, 'PNG')
+                return buffer.getvalue()
         except ImportError:
             pass
         except Exception as e3:
@@ -221,7 +343,7 @@ def _convert_ai_eps_to_raster(file_path: str) -> str:
         
         # If all methods fail, raise a helpful error
         raise ValueError(
-            f"Could not convert {file_path} to raster format. "
+            f"Could not convert file to raster format. "
             f"Please ensure:\n"
             f"1. For EPS files: Ghostscript is installed (required for PIL to read EPS)\n"
             f"2. For AI files: The file is readable (may need to be exported from Illustrator)\n"
@@ -229,124 +351,179 @@ def _convert_ai_eps_to_raster(file_path: str) -> str:
         )
 
 
-def extract_svg_colors(file_path):
-    def is_white(color):
-        color = color.strip().lower()
-        if color in ['#fff', '#ffffff', '#FFF', '#FFFFFF', 'white']:
-            return True
-        rgb_match = re.match(r'rgb\s*\(\s*255\s*,\s*255\s*,\s*255\s*\)', color)
-        if rgb_match:
-            return True
-        rgb_pct_match = re.match(r'rgb\s*\(\s*100%\s*,\s*100%\s*,\s*100%\s*\)', color)
-        if rgb_pct_match:
-            return True
-        rgba_match = re.match(r'rgba\s*\(\s*255\s*,\s*255\s*,\s*255\s*,\s*1(\.0*)?\s*\)', color)
-        if rgba_match:
-            return True
-        rgba_pct_match = re.match(r'rgba\s*\(\s*100%\s*,\s*100%\s*,\s*100%\s*,\s*1(\.0*)?\s*\)', color)
-        if rgba_pct_match:
-            return True
-        return False
+_WHITE = frozenset({'#fff', '#ffffff', 'white'})
+_RGB_RE = re.compile(r'rgba?\s*\(([^)]+)\)')
+_GRADIENT_TAGS = frozenset({'linearGradient', 'radialGradient'})
 
-    def is_visible(tag):
-        style = tag.get('style', '')
-        if 'display:none' in style or 'visibility:hidden' in style or 'opacity:0' in style:
-            return False
-        if tag.get('display') == 'none' or tag.get('visibility') == 'hidden' or tag.get('opacity') == '0':
-            return False
-        return True
 
-    def normalize_color(color):
-        color = color.strip().lower()
-        if is_white(color):
-            return 'white'
-        # Hex color
-        if color.startswith('#'):
-            if len(color) == 4:
-                # e.g. #abc -> #aabbcc
-                color = '#' + ''.join([c*2 for c in color[1:]])
-            return color.upper()
-        # rgb/rgba
-        rgb_match = re.match(r'rgb\s*\(([^)]+)\)', color)
-        if rgb_match:
-            parts = rgb_match.group(1).split(',')
-            if '%' in parts[0]:
-                # rgb(100%,100%,100%)
-                vals = [int(float(p.strip().replace('%','')) * 2.55) for p in parts[:3]]
-            else:
-                vals = [int(float(p.strip())) for p in parts[:3]]
-            return '#{:02X}{:02X}{:02X}'.format(*vals)
-        # named color
-        return color
-
-    with open(file_path, 'r', encoding='utf-8') as file:
-        soup = BeautifulSoup(file.read(), 'xml')
-    colors = set()
-    # 1. Extract visible fill/stroke colors
-    for tag in soup.find_all(True):
-        if not is_visible(tag):
-            continue
-        for attr in ['fill', 'stroke']:
-            val = tag.get(attr)
-            if val and val.strip().lower() not in ['none', 'transparent'] and not val.startswith('url('):
-                colors.add(normalize_color(val))
-        style = tag.get('style')
-        if style:
-            for part in style.split(';'):
-                if ':' in part:
-                    prop, color_val = part.split(':', 1)
-                    prop = prop.strip().lower()
-                    color_val = color_val.strip()
-                    if prop not in ['fill', 'stroke']:
-                        continue
-                    if color_val.lower() in ['none', 'transparent'] or color_val.startswith('url('):
-                        continue
-                    colors.add(normalize_color(color_val))
-    # 2. Extract gradient stop colors
-    for grad in soup.find_all(['linearGradient', 'radialGradient']):
-        for stop in grad.find_all('stop'):
-            stop_color = stop.get('stop-color')
+def _parse_rgb(body: str):
+    # Split the inside of rgb()/rgba() into 0..255 channel values and a 0..1 alpha;
+    # raises ValueError for anything else (e.g. the space-separated rgb(10 20 30) syntax)
+    parts = [p.strip() for p in body.split(',')]
+    if len(parts) < 3:
+        raise ValueError(f"expected at least 3 color components, got {body!r}")
+    if '%' in parts[0]:
+        vals = [float(p.rstrip('%')) * 255 / 100 for p in parts[:3]]
+    else:
+        vals = [float(p) for p in parts[:3]]
+    alpha = 1.0
+    if len(parts) > 3:
+        alpha_part = parts[3]
+        alpha = float(alpha_part[:-1]) / 100 if alpha_part.endswith('%') else float(alpha_part)
+    if not all(math.isfinite(v) for v in vals + [alpha]):
+        raise ValueError(f"non-finite color component in {body!r}")
+    # Out-of-range components are clamped, as CSS does
+    vals = [min(max(v, 0.0), 255.0) for v in vals]
+    alpha = min(max(alpha, 0.0), 1.0)
+    return vals, alpha
+
+
+def _is_white(color: str) -> bool:
+    # Expects a stripped, lowercased color string
+    if color in _WHITE:
+        return True
+    rgb_match = _RGB_RE.match(color)
+    if rgb_match:
+        try:
+            vals, alpha = _parse_rgb(rgb_match.group(1))
+        except ValueError:
+            return False
+        return all(v >= 255 for v in vals) and alpha == 1.0
+    return False
+
+
+def _normalize_color(color: str) -> str:
+    # Expects a stripped, lowercased color string
+    if _is_white(color):
+        return 'white'
+    # Hex color
+    if color.startswith('#'):
+        if len(color) == 4:
+            # e.g. #abc -> #aabbcc
+            color = '#' + ''.join([c*2 for c in color[1:]])
+        return color.upper()
+    # rgb/rgba, with either 0..255 or percentage components
+    rgb_match = _RGB_RE.match(color)
+    if rgb_match:
+        try:
+            vals, _alpha = _parse_rgb(rgb_match.group(1))
+        except ValueError:
+            # Syntax we don't parse; report the value as written rather than failing the file
+            return color
+        return '#{:02X}{:02X}{:02X}'.format(*[int(v) for v in vals])
+    # named color
+    return color
+
+
+def _is_visible(attrs) -> bool:
+    style = attrs.get('style', '')
+    if 'display:none' in style or 'visibility:hidden' in style or 'opacity:0' in style:
+        return False
+    if attrs.get('display') == 'none' or attrs.get('visibility') == 'hidden' or attrs.get('opacity') == '0':
+        return False
+    return True
+
+
+def _add_paint(colors: Set[str], val: str) -> None:
+    # Expects a stripped, lowercased fill/stroke value
+    if val not in ['none', 'transparent'] and not val.startswith('url('):
+        colors.add(_normalize_color(val))
+
+
+class _SvgColorHandler(ContentHandler):
+    # SAX callbacks get each element's attributes as a mapping; no element objects are built
+    def __init__(self):
+        super().__init__()
+        self.colors: Set[str] = set()
+        self.gradient_depth = 0
+
+    def startElement(self, name, attrs):
+        tag = name.rpartition(':')[2]
+        if tag in _GRADIENT_TAGS:
+            self.gradient_depth += 1
+        style = attrs.get('style')
+        # 1. Extract visible fill/stroke colors
+        if _is_visible(attrs):
+            fill = attrs.get('fill')
+            if fill:
+                _add_paint(self.colors, fill.strip().lower())
+            stroke = attrs.get('stroke')
+            if stroke:
+                _add_paint(self.colors, stroke.strip().lower())
+            if style:
+                style_lower = style.lower()
+                # Only split styles that can actually contain a fill/stroke declaration
+                if 'fill' in style_lower or 'stroke' in style_lower:
+                    for part in style_lower.split(';'):
+                        if ':' in part:
+                            prop, color_val = part.split(':', 1)
+                            if prop.strip() in ['fill', 'stroke']:
+                                _add_paint(self.colors, color_val.strip())
+        # 2. Extract gradient stop colors
+        if tag == 'stop' and self.gradient_depth:
+            stop_color = attrs.get('stop-color')
             if stop_color:
-                colors.add(normalize_color(stop_color))
-            stop_style = stop.get('style')
-            if stop_style:
+                self.colors.add(_normalize_color(stop_color.strip().lower()))
+            if style and 'stop-color' in style:
                 # Only add stop-color, ignore stop-opacity, offset, etc.
-                for part in stop_style.split(';'):
+                for part in style.split(';'):
                     if part.strip().startswith('stop-color:'):
-                        color_val = part.split(':',1)[1].strip()
-                        colors.add(normalize_color(color_val))
-    return len(colors), colors
+                        color_val = part.split(':',1)[1].strip().lower()
+                        self.colors.add(_normalize_color(color_val))
+
+    def endElement(self, name):
+        if name.rpartition(':')[2] in _GRADIENT_TAGS:
+            self.gradient_depth -= 1
 
-def detect_colors(file_path):
-    ext = os.path.splitext(file_path)[1].lower()
-    temp_file = None
-    
+
+def _recover_svg_colors(data: bytes, handler: _SvgColorHandler) -> None:
+    # Drive the same handler from lxml's recovering parser, which keeps going past
+    # undefined entities, truncated tails and other well-formedness errors
     try:
-        if ext == '.svg':
-            return extract_svg_colors(file_path)
-        elif ext in ['.ai', '.eps']:
-            # Convert vector format to raster first
-            temp_file = _convert_ai_eps_to_raster(file_path)
-            # Process the converted raster image
-            result = count_raster_colors(temp_file)
-            return result
-        else:
-            # All other raster formats handled here: png, jpg/jpeg, webp, bmp, tiff, gif, etc.
-            return count_raster_colors(file_path)
-    finally:
-        # Clean up temporary converted file
-        if temp_file and os.path.exists(temp_file):
-            try:
-                os.remove(temp_file)
-            except:
-                pass
+        for event, el in etree.iterparse(BytesIO(data), events=('start', 'end'), recover=True):
+            if not isinstance(el.tag, str):
+                continue
+            tag = etree.QName(el).localname
+            if event == 'start':
+                handler.startElement(tag, el.attrib)
+            else:
+                handler.endElement(tag)
+                el.clear()
+    except etree.XMLSyntaxError:
+        # Nothing left to recover (e.g. an empty file); keep the colors seen so far
+        pass
+
+
+def extract_svg_colors(data: bytes):
+    handler = _SvgColorHandler()
+    try:
+        xml.sax.parseString(data, handler)
+    except xml.sax.SAXParseException:
+        # expat stops at the first error; re-parse malformed documents with recovery
+        handler = _SvgColorHandler()
+        _recover_svg_colors(data, handler)
+    colors = handler.colors
+    return len(colors), colors
+
+def detect_colors(data: bytes, ext: str, fast_mode: bool = False):
+    ext = ext.lower()
+    if ext == '.svg':
+        return extract_svg_colors(data)
+    elif ext in ['.ai', '.eps']:
+        # Convert vector format to raster first, then process the converted image
+        return count_raster_colors(_convert_ai_eps_to_raster(data), fast_mode)
+    else:
+        # All other raster formats handled here: png, jpg/jpeg, webp, bmp, tiff, gif, etc.
+        return count_raster_colors(data, fast_mode)
 
 if __name__ == "__main__":
     file_path = input("Enter path to image file (any format or .svg): ").strip()
     if not os.path.isfile(file_path):
         print("File not found. Please check the path.")
     else:
-        count, colors = detect_colors(file_path)
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        count, colors = detect_colors(data, os.path.splitext(file_path)[1])
         print(f"\n✅ Total Colors Detected: {count}")
         print("🎨 Unique Colors List:")
         for color in colors: